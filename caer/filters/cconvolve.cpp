@@ -44,22 +44,27 @@ namespace{
         const npy_intp Nf = filter.size();
         const npy_intp centre = Nf/2;
 
-        for (npy_intp y = 0; y != N0; ++y) {
-            if (centre >= N1) break;
-            const T* base0 = array.data(y);
-            // The two loops (over x & x_) are almost the same.
-            // However, combining them, whilst leading to better code, made the result much slower (probably /// because there was a need to
-            // test the value of x in the inner loop).
-
-            T* out = result.data(y,centre);
-            for (npy_intp x = centre; x != (N1 - centre); ++x) {
-                double cur = 0;
-                for (npy_intp j = 0; j != Nf; ++j) {
-                    const double val = base0[(x + j-centre)*step];
-                    assert(val == array.at(y, x - centre + j));
-                    cur += val * fdata[j];
+        if (centre < N1) {
+            // Rows are fully independent (each iteration only reads `array`
+            // and writes its own row of `result`), so the loop can run
+            // per-row in parallel. The GIL is already released above.
+            #pragma omp parallel for
+            for (npy_intp y = 0; y < N0; ++y) {
+                const T* base0 = array.data(y);
+                // The two loops (over x & x_) are almost the same.
+                // However, combining them, whilst leading to better code, made the result much slower (probably /// because there was a need to
+                // test the value of x in the inner loop).
+
+                T* out = result.data(y,centre);
+                for (npy_intp x = centre; x != (N1 - centre); ++x) {
+                    double cur = 0;
+                    for (npy_intp j = 0; j != Nf; ++j) {
+                        const double val = base0[(x + j-centre)*step];
+                        assert(val == array.at(y, x - centre + j));
+                        cur += val * fdata[j];
+                    }
+                    *out++ = T(cur); // consider T(std::round(cur)) as well
                 }
-                *out++ = T(cur); // consider T(std::round(cur)) as well
             }
         }
 
@@ -36,6 +36,12 @@ namespace {
     template <typename T>
     inline T t_abs(T val) { return (val >= 0 ? val : -val); }
 
+    // Forward declaration: central_position() is defined further down but is
+    // called from templates above its definition (neighbours, get_filter),
+    // which modern compilers reject under two-phase lookup
+    template <typename T>
+    numpy::position central_position(const numpy::array_base<T>& array);
+
     template <typename T>
     std::vector<numpy::position> neighbours(const numpy::aligned_array<T>& Bc, bool include_centre = false) {
         numpy::position centre = central_position(Bc);
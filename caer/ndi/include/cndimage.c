@@ -1151,7 +1151,10 @@ static struct PyModuleDef moduledef = {
     NULL
 };
 
-PyObject *PyInit_cndi(void)
+/* PyMODINIT_FUNC carries default visibility, which keeps the module export
+   function in the dynamic symbol table when building with
+   -fvisibility=hidden */
+PyMODINIT_FUNC PyInit_cndi(void)
 {
     PyObject *m;
 
@@ -51,8 +51,6 @@ MICRO = 7
 ISRELEASED = True
 VERSION = f'{MAJOR}.{MINOR}.{MICRO}'
 
-RUN_CYTHON_BUILD = False
-
 min_version = (3, 6, 1)
 
 def is_right_py_version(min_py_version):
@@ -74,9 +72,16 @@ if not is_right_py_version(min_version):
 
 from setuptools import setup, Extension, find_packages
 from distutils.command.build_ext import build_ext
+from distutils.command.build_clib import build_clib
+from distutils.ccompiler import CCompiler
 from configparser import ConfigParser
+from functools import lru_cache
+from multiprocessing.pool import ThreadPool
 import subprocess
-import os 
+import sysconfig
+import tempfile
+import json
+import os
 
 # Git version stuff
 sha = 'Unknown'
@@ -91,13 +96,40 @@ except Exception:
 # Configurations
 
 # All settings are in configs.ini
-config = ConfigParser(delimiters=['='])
-config.read('configs.ini')
-cfg = config['metadata']
+CONFIG_CACHE = os.path.join('build', 'configs_ini_cache.json')
+
+def read_config(filename='configs.ini'):
+    # Parsing + validating configs.ini repeats for every pip sub-invocation
+    # (egg_info, bdist_wheel, install), so the parsed mapping is cached as
+    # JSON under build/, keyed by the file's mtime
+    mtime = os.stat(filename).st_mtime_ns
+
+    try:
+        with open(CONFIG_CACHE) as f:
+            cached = json.load(f)
+        if cached['mtime_ns'] == mtime:
+            return cached['metadata']
+    except (OSError, ValueError, KeyError):
+        pass
+
+    config = ConfigParser(delimiters=['='])
+    config.read(filename)
+    metadata = dict(config['metadata'])
+
+    cfg_keys = 'description keywords author author_email contributors'.split()
+    expected = cfg_keys + "name user git_branch license status audience language dev_language".split()
+    for i in expected: assert i in metadata, f'Missing expected setting: {i}'
 
-cfg_keys = 'description keywords author author_email contributors'.split()
-expected = cfg_keys + "name user git_branch license status audience language dev_language".split()
-for i in expected: assert i in cfg, f'Missing expected setting: {i}'
+    try:
+        os.makedirs(os.path.dirname(CONFIG_CACHE), exist_ok=True)
+        with open(CONFIG_CACHE, 'w') as f:
+            json.dump({'mtime_ns': mtime, 'metadata': metadata}, f)
+    except OSError:
+        pass
+
+    return metadata
+
+cfg = read_config()
 
 # def set_builtin(name, value):
 #     if isinstance(__builtins__, dict):
@@ -107,7 +139,6 @@ for i in expected: assert i in cfg, f'Missing expected setting: {i}'
 
 # # Prevent numpy from thinking it is still in its setup process:
 # set_builtin('__NUMPY_SETUP__', False)
-import numpy as np 
 
 
 # Defining Setup Variables
@@ -123,19 +154,21 @@ PLATFORMS = ['Any']
 GIT_URL = cfg['git_url']
 DOCS_URL = cfg['docs_url']
 DOWNLOAD_URL = cfg['download_url']
-PACKAGES = [i for i in find_packages() if 'tests' not in i]
 DESCRIPTION = cfg['description']
-LONG_DESCRIPTION = open('README.md', encoding='utf-8').read()
 KEYWORDS = [i for i in cfg['keywords'].split(', ')]
 REQUIREMENTS = [i for i in cfg['pip_requirements'].split(', ')]
 CLASSIFIERS = [i for i in cfg['classifiers'].split('\n')][1:]
 PYTHON_REQUIRES = '>=' + cfg['min_python']
 EXTENSIONS = {
     'caer.filters.cconvex': ['caer/filters/cconvex.cpp'],
-    'caer.filters.cconvolve': ['caer/filters/cconvolve.cpp', 'caer/src/cfilters.cpp'],
+    'caer.filters.cconvolve': ['caer/filters/cconvolve.cpp'],
     'caer.distance.cdistance': ['caer/distance/cdistance.cpp'],
-    'caer.morph.cmorph': ['caer/morph/cmorph.cpp', 'caer/src/cfilters.cpp'],
-    'caer.ndi.cndi' : ['caer/ndi/include/cndimage.c', 
+    'caer.morph.cmorph': ['caer/morph/cmorph.cpp'],
+    # cndi deliberately stays a single extension: the parallel compile in
+    # build_extension_class fans out per source file, so its eight .c files
+    # already build concurrently (with CAER_NUM_BUILD_JOBS >= 8) without
+    # splitting the module and re-exporting symbols from caer/ndi/__init__.py
+    'caer.ndi.cndi' : ['caer/ndi/include/cndimage.c',
                        'caer/ndi/include/cndfilters.c',
                        'caer/ndi/include/cndfourier.c',
                        'caer/ndi/include/cndinterpolation.c',
@@ -145,7 +178,97 @@ EXTENSIONS = {
                        'caer/ndi/include/cndsupport.c'
                 ]
 }
-EXT_MODULES = [Extension(key, sources=sources, include_dirs=[np.get_include()]) for key, sources in EXTENSIONS.items()]
+
+# C sources shared by more than one extension. Each is compiled once into a
+# small static helper library by build_clib and linked into its consumers,
+# instead of being recompiled per-extension
+CLIBS = {
+    'caer_filters': ['caer/src/cfilters.cpp'],
+}
+
+EXT_LIBRARIES = {
+    'caer.filters.cconvolve': ['caer_filters'],
+    'caer.morph.cmorph': ['caer_filters'],
+}
+
+# Compiler directives applied when the extensions are regenerated from their
+# Cython sources. The bounds/wraparound/initializedcheck guards cost real time
+# in the cconvolve/cmorph inner loops, so they are switched off here instead
+# of being sprinkled over every kernel
+CYTHON_DIRECTIVES = {
+    'boundscheck': False,
+    'wraparound': False,
+    'cdivision': True,
+    'initializedcheck': False,
+    'language_level': 3,
+}
+
+# Hot pure-Python modules worth compiling in Cython's "pure Python" mode.
+# The .py sources stay importable unchanged; Cython merely strips the
+# interpreter dispatch overhead. Opt-in via CAER_CYTHONIZE_PURE=1 since it
+# adds build time and one shared object per module
+PURE_PY_CYTHON = [
+    'caer/core.py',
+    'caer/preprocessing/mean_subtraction.py',
+    'caer/transforms/functional.py',
+    'caer/transforms/position.py',
+    'caer/path/paths.py',
+]
+
+PURE_PY_DIRECTIVES = {
+    'boundscheck': False,
+    'infer_types': True,
+    'language_level': 3,
+}
+
+@lru_cache(maxsize=None)
+def get_ext_modules():
+    # NumPy is only needed for its headers when the extensions are built.
+    # Importing it here (rather than at module level) keeps sdist/metadata
+    # commands runnable in environments without it, and lets PEP 517
+    # isolated builds resolve it from build-system.requires
+    import numpy as np
+
+    try:
+        from Cython.Build import cythonize
+    except ImportError:
+        # End-users (and Python-only developers) build from the pre-generated
+        # .c/.cpp sources checked into the repo and do not need Cython
+        cythonize = None
+
+    ext_modules = [Extension(key, sources=sources, include_dirs=[np.get_include()], libraries=EXT_LIBRARIES.get(key, [])) for key, sources in EXTENSIONS.items()]
+
+    if cythonize is not None:
+        # cache= lets Cython skip the .pyx --> .c translation entirely for
+        # files that have not changed since the last build (hash-based). Set
+        # CC='ccache gcc' in the environment to get the same effect for the
+        # C compile phase (distutils picks CC up on its own)
+        ext_modules = cythonize(ext_modules,
+                                compiler_directives=CYTHON_DIRECTIVES,
+                                nthreads=os.cpu_count() or 1,
+                                cache=os.path.join(here, '.cython_cache'))
+
+        if os.environ.get('CAER_CYTHONIZE_PURE') == '1':
+            ext_modules += cythonize(PURE_PY_CYTHON,
+                                     compiler_directives=PURE_PY_DIRECTIVES,
+                                     nthreads=os.cpu_count() or 1,
+                                     cache=os.path.join(here, '.cython_cache'))
+
+    return ext_modules
+
+
+@lru_cache(maxsize=None)
+def get_c_libraries():
+    import numpy as np
+
+    # Unlike build_ext, build_clib does not add the Python header directory
+    # on its own, so Python.h has to be spelled out alongside NumPy's headers
+    paths = sysconfig.get_paths()
+    include_dirs = [np.get_include(), paths['include']]
+    if paths['platinclude'] not in include_dirs:
+        include_dirs.append(paths['platinclude'])
+
+    return [(name, {'sources': sources, 'include_dirs': include_dirs}) for name, sources in CLIBS.items()]
 
 STATUSES = [ 
     '1 - Planning', 
@@ -162,17 +285,31 @@ META_PY_TEXT =\
 """
 # This file is automatically generated during the generation of setup.py
 # Copyright 2020-2021, Caer
-author = '%(author)s'
-author_email = '%(author_email)s'
-version = '%(version)s'
-full_version = '%(full_version)s'
-git_version = %(git_version)s
-release = %(isrelease)s
-contributors = %(contributors)s
-homepage = '%(homepage)s'
+author = '{author}'
+author_email = '{author_email}'
+version = '{version}'
+full_version = '{full_version}'
+git_version = {git_version}
+release = {isrelease}
+contributors = {contributors}
+homepage = '{homepage}'
 """
 
 
+# Walking the source tree and reading README.md is wasted work for
+# metadata-only invocations (egg_info and friends), so both are computed
+# on first use from setup_package() rather than at import time
+
+@lru_cache(maxsize=None)
+def get_packages():
+    return [i for i in find_packages() if 'tests' not in i]
+
+
+@lru_cache(maxsize=None)
+def get_long_description(filename='README.md'):
+    return open(filename, encoding='utf-8').read()
+
+
 def get_contributors_list(filename='CONTRIBUTORS'):
     contr = [] 
     with open(filename, 'r') as a:
@@ -184,64 +321,171 @@ def get_contributors_list(filename='CONTRIBUTORS'):
 
 
 def write_meta(filename='caer/_meta.py'):
-    print('[INFO] Writing _meta.py')
-    TEXT = META_PY_TEXT
     FULL_VERSION = VERSION
     CONTRIBUTORS = get_contributors_list()
     HOMEPAGE = GIT_URL
-    
-    a = open(filename, 'w')
 
+    new_text = META_PY_TEXT.format(author=AUTHOR,
+                                   author_email=str(AUTHOR_EMAIL),
+                                   version=VERSION,
+                                   full_version=FULL_VERSION,
+                                   git_version=GIT_VERSION,
+                                   isrelease=str(ISRELEASED),
+                                   contributors=CONTRIBUTORS,
+                                   homepage=str(HOMEPAGE))
+
+    # Leaving an identical file untouched preserves its __pycache__ entry,
+    # so the next 'import caer' does not recompile _meta.py
+    if os.path.exists(filename):
+        with open(filename) as a:
+            if a.read() == new_text:
+                print('[INFO] _meta.py is up to date')
+                return
+
+    print('[INFO] Writing _meta.py')
+    # Write to a temp file and os.replace() it in, so an interrupted build
+    # can never leave a truncated _meta.py behind
+    tmp = tempfile.NamedTemporaryFile('w', dir=os.path.dirname(filename), suffix='.tmp', delete=False)
     try:
-        a.write(TEXT % {'author': AUTHOR,
-                        'author_email': str(AUTHOR_EMAIL),
-                        'version': VERSION,
-                       'full_version': FULL_VERSION,
-                       'git_version': GIT_VERSION,
-                       'isrelease': str(ISRELEASED),
-                       'contributors': CONTRIBUTORS,
-                       'homepage': str(HOMEPAGE) })
-    finally:
-        a.close()
+        tmp.write(new_text)
+        tmp.close()
+        os.replace(tmp.name, filename)
+    except BaseException:
+        tmp.close()
+        os.unlink(tmp.name)
+        raise
 
 
 def get_docs_url():
     return DOCS_URL
 
 
-CYTHON_SOURCES = ('',)
-def generate_cython():
-    cwd = os.path.abspath(os.path.dirname(__file__))
-    print('[INFO] Cythonizing sources')
-    p = subprocess.call([sys.executable,
-                        os.path.join(cwd, 'tools', 'cythonize.py')],
-                        cwd=cwd)
-    if p != 0:
-        raise RuntimeError('[ERROR] Running cythonize failed!')
-
-
 copt={
-    'msvc': ['/EHsc'], 
-    'intelw': ['/EHsc']  
+    'msvc': ['/EHsc'],
+    'intelw': ['/EHsc'],
+    'unix': ['-O3', '-ffast-math', '-funroll-loops', '-fopenmp', '-flto', '-fvisibility=hidden']
+}
+
+lopt={
+    'unix': ['-fopenmp', '-flto']
 }
 
+# -march=native emits binaries that only run on the build machine, so it is
+# opt-in; wheels built for distribution must stay portable
+if os.environ.get('CAER_NATIVE_ARCH') == '1':
+    copt['unix'].append('-march=native')
+
+
+def get_num_build_jobs():
+    # Parallel compilation is opt-in (set CAER_NUM_BUILD_JOBS or MAX_JOBS).
+    # Defaults to a serial build since not every compiler setup is safe to
+    # run in parallel
+    jobs = os.environ.get('CAER_NUM_BUILD_JOBS', os.environ.get('MAX_JOBS'))
+    if jobs is None:
+        return 1
+
+    jobs = int(jobs)
+    if jobs <= 0:
+        return os.cpu_count() or 1
+
+    return jobs
+
+
 class build_extension_class(build_ext):
     def build_extensions(self):
+        # build_ext only appends build_clib's output dir to the library
+        # search path; it never runs the command. Build the helper libs here
+        # so a bare 'python setup.py build_ext' links too
+        if self.distribution.has_c_libraries():
+            self.run_command('build_clib')
+
         c = self.compiler.compiler_type
-        if c in copt:
-            for e in self.extensions:
+        for e in self.extensions:
+            if c in copt:
                 e.extra_compile_args = copt[c]
+            if c in lopt:
+                e.extra_link_args = lopt[c]
+        self._enable_parallel_compile()
         build_ext.build_extensions(self)
 
+    def _enable_parallel_compile(self):
+        # Compiling the C/C++ sources is by far the slowest part of the build.
+        # Each source file is independent, so we fan the per-object compiles
+        # out over a thread pool (the actual work happens in the C compiler
+        # subprocesses, so threads are enough)
+        parallel = get_num_build_jobs()
+        if parallel == 1:
+            return
+
+        compiler = self.compiler
+
+        # The fan-out below relies on the compiler exposing per-object
+        # _compile(). MSVC overrides compile() wholesale and leaves the base
+        # CCompiler._compile a no-op, so patching it there would "compile"
+        # nothing and fail later at link; stay serial in that case
+        if type(compiler)._compile is CCompiler._compile:
+            return
+
+        def parallel_compile(sources, output_dir=None, macros=None, include_dirs=None, debug=0, extra_preargs=None, extra_postargs=None, depends=None):
+            macros, objects, extra_postargs, pp_opts, build = compiler._setup_compile(output_dir, macros, include_dirs, sources, depends, extra_postargs)
+            cc_args = compiler._get_cc_args(pp_opts, debug, extra_preargs)
+
+            def _single_compile(obj):
+                try:
+                    src, ext = build[obj]
+                except KeyError:
+                    return
+                compiler._compile(obj, src, ext, cc_args, extra_postargs, pp_opts)
+
+            print(f'[INFO] Compiling {len(objects)} object(s) with {parallel} workers')
+            with ThreadPool(parallel) as pool:
+                pool.map(_single_compile, objects)
+
+            return objects
+
+        compiler.compile = parallel_compile
+
+class build_clib_class(build_clib):
+    def build_libraries(self, libraries):
+        # distutils' build_clib has no extra_compile_args hook, so the shared
+        # kernels would silently miss the per-compiler flags the extensions
+        # get; mirror copt here
+        c = self.compiler.compiler_type
+        cflags = copt.get(c)
+
+        for (lib_name, build_info) in libraries:
+            objects = self.compiler.compile(list(build_info.get('sources')),
+                                            output_dir=self.build_temp,
+                                            macros=build_info.get('macros'),
+                                            include_dirs=build_info.get('include_dirs'),
+                                            extra_postargs=cflags,
+                                            debug=self.debug)
+            self.compiler.create_static_lib(objects, lib_name, output_dir=self.build_clib, debug=self.debug)
+
+
 CMDCLASS = {
+    'build_clib': build_clib_class,
     'build_ext': build_extension_class
 }
 
 
+# Commands that never build the extensions. pip invokes several of these
+# repeatedly during dependency resolution, so they must not pull in NumPy,
+# Cython or the compiler toolchain
+METADATA_ONLY_COMMANDS = ('sdist', 'egg_info', 'dist_info', 'clean')
+
+
 def setup_package():
-    # Rewrite the meta file everytime
+    # Refresh the meta file if its inputs changed
     write_meta()
 
+    # Build commands take precedence: 'sdist bdist_wheel' must still compile
+    # the extensions. Skip the build only when every command given is
+    # metadata-only (option-only invocations like --version/--help count as
+    # metadata-only as well)
+    commands = [c for c in sys.argv[1:] if not c.startswith('-')]
+    run_build = any(c not in METADATA_ONLY_COMMANDS for c in commands)
+
     metadata = dict(
         name = NAME,
         version = VERSION,
@@ -249,7 +493,7 @@ def setup_package():
         author_email = AUTHOR_EMAIL,
         maintainer = AUTHOR,
         description = DESCRIPTION,
-        long_description = LONG_DESCRIPTION,
+        long_description = get_long_description(),
         long_description_content_type = 'text/markdown',
         url = GIT_URL,
         download_url = DOWNLOAD_URL,
@@ -259,13 +503,11 @@ def setup_package():
             'Funding': FUNDING,
             'Source Code': GIT_URL,
         },
-        packages = PACKAGES,
-        # ext_modules = EXT_MODULES,
+        packages = get_packages(),
         license = LICENSE,
         platforms = PLATFORMS,
         install_requires = REQUIREMENTS,
         python_requires = PYTHON_REQUIRES,
-        # cmdclass = CMDCLASS,
 # Include_package_data is required for setup.py to recognize the MAINFEST.in file
 # https://python-packaging.readthedocs.io/en/latest/non-code-files.html
         include_package_data = True,
@@ -274,9 +516,10 @@ def setup_package():
         classifiers = CLASSIFIERS,
     )
 
-    # run_build = RUN_CYTHON_BUILD
-    # if run_build:
-    #     generate_cython()
+    if run_build:
+        metadata['ext_modules'] = get_ext_modules()
+        metadata['libraries'] = get_c_libraries()
+        metadata['cmdclass'] = CMDCLASS
 
     setup(**metadata)
 
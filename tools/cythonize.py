@@ -70,7 +70,7 @@ from setuptools import setup
 from Cython.Build import cythonize
 
 setup(
-    ext_modules=cythonize(%(source)s),
+    ext_modules=cythonize(%(source)s, nthreads=%(nthreads)d, language_level=3),
     zip_safe=False,
 )
 """
@@ -98,7 +98,7 @@ def normpath(path):
     return path
 
 
-def process_pyx():
+def process_pyx(nthreads=1):
     flags = ['-3', '--inplace']
     build_cython = True
 
@@ -117,7 +117,10 @@ def process_pyx():
     # required_cython_version = '0.29.21'
     with open(pyproject_toml) as f:
         for line in f:
-            if 'cython' not in line.lower():
+            line = line.strip()
+            # Comment lines can mention Cython too; only the requires entry
+            # carries the version pin
+            if line.startswith('#') or 'cython' not in line.lower():
                 continue
             _, line = line.split('=')
             required_cython_version, _ = line.split("'")
@@ -140,7 +143,8 @@ def process_pyx():
         a = open('tools/build_cython.py', 'w')
         try:
             a.write(SETUP_TEXT % {'time': datetime.date.today().strftime("%B %d, %Y") ,
-                                  'source': CYTHON_SOURCES } )
+                                  'source': CYTHON_SOURCES,
+                                  'nthreads': nthreads } )
         finally:
             a.close()
 
@@ -162,12 +166,25 @@ def process_pyx():
 
 
 
+def get_nthreads(argv):
+    # `-j N`/`--nthreads N` asks Cython to translate the .pyx files with a
+    # process pool of N workers (defaults to a serial run)
+    for flag in ('-j', '--nthreads'):
+        if flag in argv:
+            try:
+                return int(argv[argv.index(flag) + 1])
+            except (IndexError, ValueError):
+                sys.stderr.write(f'[ERROR] {flag} expects an integer argument\n')
+                sys.exit(1)
+    return 1
+
+
 def main():
     # try:
     #     ROOT_DIR = sys.argv[1]
     # except IndexError:
     #     ROOT_DIR = ROOT_DIR
-    process_pyx()
+    process_pyx(nthreads=get_nthreads(sys.argv[1:]))
 
 
 if __name__ == '__main__':